@@ -32,7 +32,7 @@ def eval_iter_callback(tensors,
         global_vars["all_slot_labels"] = []
 
     intent_logits_lists, intent_labels_lists = [], []
-    slot_logits_lists, slot_labels_lists = [], []
+    slot_preds, slot_labels_lists = [], []
 
     for kv, v in tensors.items():
         if kv.startswith('intent_logits'):
@@ -46,9 +46,12 @@ def eval_iter_callback(tensors,
                     intent_labels_lists.append(tensor2list(label_tensor))
 
         if kv.startswith('slot_logits'):
+            # batches may be padded to different lengths, so keep the
+            # predictions flat like the slot labels instead of stacking
             for v_tensor in v:
                 for logit_tensor in v_tensor:
-                    slot_logits_lists.append(tensor2list(logit_tensor))
+                    slot_preds.extend(
+                        np.argmax(tensor2list(logit_tensor), 1).tolist())
 
         if kv.startswith('slots'):
             for v_tensor in v:
@@ -56,7 +59,6 @@ def eval_iter_callback(tensors,
                     slot_labels_lists.extend(tensor2list(label_tensor))
 
     intent_preds = list(np.argmax(np.asarray(intent_logits_lists), 1))
-    slot_preds = list(np.argmax(np.asarray(slot_logits_lists), 2).flatten())
     global_vars["all_intent_preds"].extend(intent_preds)
     global_vars["all_intent_labels"].extend(intent_labels_lists)
     global_vars["all_slot_preds"].extend(slot_preds)
@@ -64,7 +66,7 @@ def eval_iter_callback(tensors,
 
 
 def list2str(l):
-    return ' '.join([str(j) for j in l])
+    return ' '.join(map(str, l))
 
 
 def eval_epochs_done_callback(global_vars, graph_fold):
@@ -1,12 +1,16 @@
 # Copyright (c) 2019 NVIDIA Corporation
+import os
+
 import torch
 
 import nemo
 from nemo.backends.pytorch.nm import DataLayerNM
+from nemo.core import DeviceType
 from nemo.core.neural_types import *
 from .datasets import BertSentenceClassificationDataset,\
     BertJointIntentSlotDataset, \
-    BertJointIntentSlotInferDataset
+    BertJointIntentSlotInferDataset, \
+    LengthBucketSampler
 
 
 class BertSentenceClassificationDataLayer(DataLayerNM):
@@ -91,6 +95,20 @@ class BertJointIntentSlotDataLayer(DataLayerNM):
         num_samples: number of samples you want to use for the dataset.
                      if -1, use all dataset.
                      useful for testing.
+        tokenize_workers: number of processes used to tokenize the queries.
+        cache_dir: directory to cache the featurized dataset in.
+                   if None, the dataset is featurized on every run.
+        bucket: if True, batches are made of samples of similar length
+                and padded only up to their longest sample, instead of
+                padding all samples to max_seq_length.
+                Batches then have different widths: the joint intent/slot
+                eval callback handles that, but code that concatenates
+                the outputs of several batches, such as
+                examples/nlp/joint_intent_slot_infer.py, needs
+                bucket=False. Not supported in distributed training.
+                The batches are shuffled if shuffle is passed as True, or
+                if it is not passed and mode is 'train', as PtActions
+                does for non-bucketed data layers.
     """
     @staticmethod
     def create_ports():
@@ -128,6 +146,9 @@ class BertJointIntentSlotDataLayer(DataLayerNM):
                  tokenizer,
                  max_seq_length,
                  num_samples=-1,
+                 tokenize_workers=1,
+                 cache_dir=None,
+                 bucket=False,
                  **kwargs):
         DataLayerNM.__init__(self, **kwargs)
         self._dataset = BertJointIntentSlotDataset(
@@ -136,18 +157,46 @@ class BertJointIntentSlotDataLayer(DataLayerNM):
             pad_label=pad_label,
             tokenizer=tokenizer,
             max_seq_length=max_seq_length,
-            num_samples=num_samples)
+            num_samples=num_samples,
+            tokenize_workers=tokenize_workers,
+            cache_dir=cache_dir,
+            bucket=bucket)
+
+        self._dataloader = None
+        if bucket:
+            if self._placement == DeviceType.AllGpu:
+                raise ValueError(
+                    "bucket=True is not supported with DeviceType.AllGpu "
+                    "placement (distributed training)")
+            batch_size = self.local_parameters["batch_size"]
+            # PtActions shuffles training data by default but not
+            # evaluation data, follow it when shuffle is not passed
+            shuffle = self.local_parameters.get(
+                "shuffle", self.local_parameters.get("mode") == "train")
+            sampler = LengthBucketSampler(
+                self._dataset.get_lengths(),
+                batch_size,
+                shuffle=shuffle)
+            self._dataloader = torch.utils.data.DataLoader(
+                dataset=self._dataset,
+                batch_size=batch_size,
+                sampler=sampler,
+                collate_fn=self._dataset.collate_fn,
+                num_workers=self.local_parameters.get(
+                    "num_workers", os.cpu_count()))
 
     def __len__(self):
         return len(self._dataset)
 
     @property
     def dataset(self):
+        if self._dataloader is not None:
+            return None
         return self._dataset
 
     @property
     def data_iterator(self):
-        return None
+        return self._dataloader
 
 
 class BertJointIntentSlotInferDataLayer(DataLayerNM):
@@ -5,5 +5,5 @@ from .question_answering import BertQuestionAnsweringDataset
 from .token_classification import BertTokenClassificationDataset
 from .sentence_classification import BertSentenceClassificationDataset
 from .joint_intent_slot import BertJointIntentSlotDataset, \
-    BertJointIntentSlotInferDataset
+    BertJointIntentSlotInferDataset, LengthBucketSampler
 from .language_modeling import LanguageModelingDataset
@@ -19,12 +19,22 @@ Some parts of this code were adapted from the HuggingFace library at
 https://github.com/huggingface/pytorch-pretrained-BERT
 """
 
-from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import hashlib
 import itertools
+import mmap
+import os
 import random
+import shutil
 
 import numpy as np
-from torch.utils.data import Dataset
+import torch
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+from torch.utils.data import Dataset, Sampler
 
 from nemo.utils.exp_logging import get_logger
 from ... import text_data_utils
@@ -35,46 +45,97 @@ logger = get_logger('')
 
 def get_stats(lengths):
     lengths = np.asarray(lengths)
-    logger.info(f'Min: {np.min(lengths)} | \
-                 Max: {np.max(lengths)} | \
-                 Mean: {np.mean(lengths)} | \
-                 Median: {np.median(lengths)}')
-    logger.info(f'75 percentile: {np.percentile(lengths, 75)} | \
-            99 percentile: {np.percentile(lengths, 99)}')
+    # one pass for all order statistics instead of one per statistic
+    min_len, median, p75, p99, max_len = np.quantile(
+        lengths, [0, 0.5, 0.75, 0.99, 1])
+    logger.info(f'Min: {min_len} | Max: {max_len} | '
+                f'Mean: {lengths.mean()} | Median: {median} | '
+                f'75 percentile: {p75} | 99 percentile: {p99}')
 
 
 def list2str(l):
-    return ' '.join([str(x) for x in l])
+    return ' '.join(map(str, l))
 
 
 def get_label_stats(labels, outfile='stats.tsv'):
-    labels = Counter(labels)
-    total = sum(labels.values())
-    out = open(outfile, 'w')
-    i = 0
-    for k, v in labels.most_common():
-        out.write(f'{k}\t{v/total}\n')
-        if i < 3:
-            logger.info(f'{i} item: {k}, {v} out of {total}, {v/total}.')
-        i += 1
-
-
-def get_features(queries,
-                 max_seq_length,
-                 tokenizer,
-                 pad_label=128,
-                 raw_slots=None):
-    all_subtokens = []
-    all_slot_masks = []
-    all_segment_ids = []
+    # labels are small non-negative ids, so count them with bincount
+    labels = np.asarray(labels, dtype=np.int64).ravel()
+    counts = np.bincount(labels)
+    total = labels.size
+    order = np.argsort(-counts, kind='stable')
+    order = order[counts[order] > 0]
+    for i, k in enumerate(order[:3]):
+        v = counts[k]
+        logger.info(f'{i} item: {k}, {v} out of {total}, {v/total}.')
+
+    lines = [f'{k}\t{counts[k]/total}\n' for k in order]
+    with open(outfile, 'w', buffering=1 << 20) as out:
+        out.writelines(lines)
+
+
+def _iter_lines(path):
+    # read through a memory map, so the file is never held in memory
+    # as a whole list of lines
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for line in iter(mm.readline, b''):
+                yield line.decode('utf-8')
+
+
+def _zip_lines(slot_lines, input_lines):
+    for slot_line, input_line in itertools.zip_longest(slot_lines,
+                                                        input_lines):
+        assert slot_line is not None and input_line is not None, \
+            'slot_file and input_file have different numbers of lines'
+        yield slot_line, input_line
+
+
+def _reservoir_sample(items, k):
+    # Algorithm R: a uniform sample of k items in one pass over the
+    # stream, without holding more than k of them in memory
+    reservoir = []
+    for i, item in enumerate(items):
+        if i < k:
+            reservoir.append(item)
+        else:
+            j = random.randint(0, i)
+            if j < k:
+                reservoir[j] = item
+    return reservoir
+
+
+def _parse_slots(slot_line):
+    fields = slot_line.split()
+    if not fields:
+        return np.zeros(0, dtype=np.int32)
+    slots = np.fromstring(slot_line, dtype=np.int32, sep=' ')
+    # np.fromstring stops at the first field it cannot parse,
+    # older NumPy versions only warn about it
+    if len(slots) != len(fields):
+        raise ValueError(f'Invalid slot line: {slot_line!r}')
+    return slots
+
+
+def _tokenize_queries(queries, tokenizer, pad_label=128, raw_slots=None):
     all_input_ids = []
-    all_input_masks = []
-    sent_lengths = []
+    all_slot_masks = []
     all_slots = []
     with_label = False
     if raw_slots is not None:
         with_label = True
 
+    # the same words repeat across queries, so only tokenize each one once
+    @lru_cache(maxsize=131072)
+    def tokenize_word(word):
+        return tuple(tokenizer.tokenize(word))
+
+    convert_tokens_to_ids = getattr(tokenizer, 'convert_tokens_to_ids', None)
+    if convert_tokens_to_ids is None:
+        def convert_tokens_to_ids(tokens):
+            return [tokenizer._convert_token_to_id(t) for t in tokens]
+
     for i, query in enumerate(queries):
         words = query.strip().split()
         subtokens = ['[CLS]']
@@ -83,7 +144,7 @@ def get_features(queries,
             slots = [pad_label]
 
         for j, word in enumerate(words):
-            word_tokens = tokenizer.tokenize(word)
+            word_tokens = tokenize_word(word)
             subtokens.extend(word_tokens)
             slot_mask.append(True)
             slot_mask.extend([False] * (len(word_tokens) - 1))
@@ -92,52 +153,256 @@ def get_features(queries,
 
         subtokens.append('[SEP]')
         slot_mask.append(True)
-        sent_lengths.append(len(subtokens))
-        all_subtokens.append(subtokens)
+        all_input_ids.append(convert_tokens_to_ids(subtokens))
         all_slot_masks.append(slot_mask)
-        all_input_masks.append([1] * len(subtokens))
         if with_label:
             slots.append(pad_label)
             all_slots.append(slots)
 
-    max_seq_length = min(max_seq_length, max(sent_lengths))
-    logger.info(f'Max length: {max_seq_length}')
-    get_stats(sent_lengths)
-    too_long_count = 0
-
-    for i, subtokens in enumerate(all_subtokens):
-        if len(subtokens) > max_seq_length:
-            subtokens = ['[CLS]'] + subtokens[-max_seq_length + 1:]
-            all_input_masks[i] = [1] + all_input_masks[i][-max_seq_length + 1:]
-            all_slot_masks[i] = [True] + \
-                all_slot_masks[i][-max_seq_length + 1:]
+    tokenize_word.cache_clear()
+    return all_input_ids, all_slot_masks, all_slots
 
-            if with_label:
-                all_slots[i] = [pad_label] + all_slots[i][-max_seq_length + 1:]
-            too_long_count += 1
 
-        all_input_ids.append([tokenizer._convert_token_to_id(t)
-                              for t in subtokens])
-        all_input_masks.append([1] * len(subtokens))
+def _encode_queries_fast(queries, tokenizer, pad_label=128, raw_slots=None):
+    """
+    Same as _tokenize_queries, but for HuggingFace fast (Rust) tokenizers,
+    which tokenize the whole batch of pre-split queries in one call.
+    Special tokens map to word id -1, so they get a slot mask of True
+    and a pad_label slot like [CLS] and [SEP] in _tokenize_queries.
+    """
+    all_slot_masks = []
+    all_slots = []
+    with_label = False
+    if raw_slots is not None:
+        with_label = True
 
-        if len(subtokens) < max_seq_length:
-            extra = (max_seq_length - len(subtokens))
-            all_input_ids[i] = all_input_ids[i] + [0] * extra
-            all_slot_masks[i] = all_slot_masks[i] + [False] * extra
-            all_input_masks[i] = all_input_masks[i] + [0] * extra
+    encodings = tokenizer([query.strip().split() for query in queries],
+                          is_split_into_words=True)
+    all_input_ids = encodings['input_ids']
+
+    for i in range(len(queries)):
+        word_ids = np.array([-1 if word_id is None else word_id
+                             for word_id in encodings.word_ids(i)],
+                            dtype=np.int64)
+        # a token starts a new word if its word id differs from the
+        # previous token's one
+        slot_mask = np.empty(len(word_ids), dtype=np.bool_)
+        slot_mask[0] = True
+        np.not_equal(word_ids[1:], word_ids[:-1], out=slot_mask[1:])
+        slot_mask |= word_ids < 0
+        all_slot_masks.append(slot_mask)
+        if with_label:
+            is_word = word_ids >= 0
+            slots = np.full(len(word_ids), pad_label, dtype=np.int64)
+            slots[is_word] = np.asarray(raw_slots[i])[word_ids[is_word]]
+            all_slots.append(slots)
 
+    return all_input_ids, all_slot_masks, all_slots
+
+
+def _fill_rows(offsets, flat_ids, flat_slot_masks, flat_slots,
+               input_ids, input_masks, slot_masks, slots, with_label):
+    max_seq_length = input_ids.shape[1]
+    for i in range(len(offsets) - 1):
+        begin = offsets[i]
+        end = offsets[i + 1]
+        col = 0
+        if end - begin > max_seq_length:
+            # keep [CLS] and the last max_seq_length - 1 tokens,
+            # slots[i, 0] is already pad_label
+            input_ids[i, 0] = flat_ids[begin]
+            input_masks[i, 0] = 1
+            slot_masks[i, 0] = True
+            begin = end - max_seq_length + 1
+            col = 1
+        for j in range(begin, end):
+            input_ids[i, col] = flat_ids[j]
+            input_masks[i, col] = 1
+            slot_masks[i, col] = flat_slot_masks[j]
             if with_label:
-                all_slots[i] = all_slots[i] + [pad_label] * extra
+                slots[i, col] = flat_slots[j]
+            col += 1
+
+
+# compiled serially: the rows are at most max_seq_length tokens, so threads
+# save nothing, and a parallel kernel makes the process hang at exit after
+# a later fork (DataLoader workers, ProcessPoolExecutor)
+_fill_rows_numba = None
+if njit is not None:
+    _fill_rows_numba = njit(cache=True)(_fill_rows)
+
+
+def _fill_rows_numpy(offsets, flat_ids, flat_slot_masks, flat_slots,
+                     input_ids, input_masks, slot_masks, slots, with_label):
+    # same as _fill_rows, vectorized over all tokens at once
+    max_seq_length = input_ids.shape[1]
+    lengths = np.diff(offsets)
+    truncated = lengths > max_seq_length
+    # first kept token of every row and the column it is written to
+    begins = offsets[:-1] + np.where(truncated,
+                                     lengths - max_seq_length + 1, 0)
+    first_cols = truncated.astype(np.int64)
+    kept = offsets[1:] - begins
+
+    rows = np.repeat(np.arange(len(lengths)), kept)
+    positions = np.arange(kept.sum()) - np.repeat(np.cumsum(kept) - kept,
+                                                  kept)
+    src = np.repeat(begins, kept) + positions
+    cols = np.repeat(first_cols, kept) + positions
+    input_ids[rows, cols] = flat_ids[src]
+    input_masks[rows, cols] = 1
+    slot_masks[rows, cols] = flat_slot_masks[src]
+    if with_label:
+        slots[rows, cols] = flat_slots[src]
+
+    # [CLS] of the truncated rows, slots[:, 0] is already pad_label
+    truncated_rows = np.nonzero(truncated)[0]
+    input_ids[truncated_rows, 0] = flat_ids[offsets[truncated_rows]]
+    input_masks[truncated_rows, 0] = 1
+    slot_masks[truncated_rows, 0] = True
 
-        all_segment_ids.append([0] * max_seq_length)
+
+def get_features(queries,
+                 max_seq_length,
+                 tokenizer,
+                 pad_label=128,
+                 raw_slots=None,
+                 num_workers=1):
+    with_label = False
+    if raw_slots is not None:
+        with_label = True
+
+    if getattr(tokenizer, 'is_fast', False):
+        all_input_ids, all_slot_masks, all_slots = _encode_queries_fast(
+            queries, tokenizer, pad_label, raw_slots)
+    elif num_workers > 1 and len(queries) > num_workers:
+        # tokenization is independent per query, so split the queries
+        # into one contiguous chunk per worker and stitch them back in order
+        bounds = np.linspace(0, len(queries), num_workers + 1).astype(int)
+        chunks = [slice(bounds[k], bounds[k + 1])
+                  for k in range(num_workers)]
+        all_input_ids, all_slot_masks, all_slots = [], [], []
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = [executor.submit(
+                _tokenize_queries,
+                queries[chunk],
+                tokenizer,
+                pad_label,
+                raw_slots[chunk] if with_label else None)
+                for chunk in chunks]
+            for future in futures:
+                input_ids, slot_masks, slots = future.result()
+                all_input_ids.extend(input_ids)
+                all_slot_masks.extend(slot_masks)
+                all_slots.extend(slots)
+    else:
+        all_input_ids, all_slot_masks, all_slots = _tokenize_queries(
+            queries, tokenizer, pad_label, raw_slots)
+
+    assert len(all_slot_masks) == len(all_input_ids)
+    if with_label:
+        assert len(all_slots) == len(all_input_ids)
+
+    sent_lengths = np.array([len(ids) for ids in all_input_ids])
+    max_seq_length = min(max_seq_length, sent_lengths.max())
+    logger.info(f'Max length: {max_seq_length}')
+    get_stats(sent_lengths)
+    too_long_count = np.count_nonzero(sent_lengths > max_seq_length)
+
+    # flatten the rows into one array per feature plus row offsets,
+    # so that the padding pass runs without Python objects
+    offsets = np.zeros(len(sent_lengths) + 1, dtype=np.int64)
+    np.cumsum(sent_lengths, out=offsets[1:])
+    flat_ids = np.concatenate(all_input_ids).astype(np.int64)
+    flat_slot_masks = np.concatenate(all_slot_masks).astype(np.bool_)
+
+    shape = (len(all_input_ids), max_seq_length)
+    input_ids = np.zeros(shape, dtype=np.int64)
+    segment_ids = np.zeros(shape, dtype=np.int64)
+    input_masks = np.zeros(shape, dtype=np.uint8)
+    slot_masks = np.zeros(shape, dtype=np.bool_)
+    if with_label:
+        flat_slots = np.concatenate(all_slots).astype(np.int64)
+        slots = np.full(shape, pad_label, dtype=np.int64)
+    else:
+        flat_slots = np.zeros(0, dtype=np.int64)
+        slots = np.zeros((0, 0), dtype=np.int64)
+
+    fill_rows = _fill_rows_numba if _fill_rows_numba is not None \
+        else _fill_rows_numpy
+    fill_rows(offsets, flat_ids, flat_slot_masks, flat_slots,
+              input_ids, input_masks, slot_masks, slots, with_label)
+    if not with_label:
+        slots = None
 
     logger.info(f'{too_long_count} are longer than {max_seq_length}')
 
-    return (all_input_ids,
-            all_segment_ids,
-            all_input_masks,
-            all_slot_masks,
-            all_slots)
+    return (input_ids,
+            segment_ids,
+            input_masks,
+            slot_masks,
+            slots)
+
+
+# bump to invalidate cached features when get_features changes
+_FEATURES_CACHE_VERSION = 2
+_CACHED_FEATURES = ('input_ids', 'segment_ids', 'input_masks',
+                    'slot_masks', 'slots', 'intents')
+
+
+def _features_cache_key(input_file, slot_file, tokenizer,
+                        max_seq_length, pad_label, shuffle):
+    key = hashlib.sha1()
+    key.update(f'{_FEATURES_CACHE_VERSION} {type(tokenizer).__name__} '
+               f'{max_seq_length} {pad_label} {shuffle}'.encode('utf-8'))
+    for path in (input_file, slot_file):
+        stat = os.stat(path)
+        key.update(f' {os.path.abspath(path)} {stat.st_size} '
+                   f'{stat.st_mtime_ns}'.encode('utf-8'))
+
+    # settings such as do_lower_case change the tokens for the same vocab
+    init_kwargs = getattr(tokenizer, 'init_kwargs', None)
+    if init_kwargs is None:
+        basic_tokenizer = getattr(tokenizer, 'basic_tokenizer', None)
+        init_kwargs = {
+            'do_basic_tokenize': getattr(tokenizer, 'do_basic_tokenize',
+                                         None),
+            'do_lower_case': getattr(basic_tokenizer, 'do_lower_case', None),
+            'never_split': getattr(basic_tokenizer, 'never_split', None)}
+    for name, value in sorted(init_kwargs.items()):
+        key.update(f' {name}={value!r}'.encode('utf-8'))
+
+    vocab = getattr(tokenizer, 'vocab', None)
+    if vocab is None and hasattr(tokenizer, 'get_vocab'):
+        vocab = tokenizer.get_vocab()
+    if vocab is not None:
+        for token, idx in sorted(vocab.items(), key=lambda item: item[1]):
+            key.update(f'{token} {idx}\n'.encode('utf-8'))
+    return key.hexdigest()
+
+
+def _load_cached_features(cache_path):
+    # copy-on-write maps stay shared between processes but, unlike
+    # read-only ones, can be wrapped into tensors without warnings.
+    # Plain ndarray views of them are returned, as default_collate of
+    # older torch versions rejects np.memmap.
+    return tuple(np.load(os.path.join(cache_path, f'{name}.npy'),
+                         mmap_mode='c').view(np.ndarray)
+                 for name in _CACHED_FEATURES)
+
+
+def _save_cached_features(cache_path, features):
+    # write to a temporary directory and rename it, so that concurrent
+    # runs never see a partially written cache
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    os.makedirs(tmp_path, exist_ok=True)
+    for name, feature in zip(_CACHED_FEATURES, features):
+        np.save(os.path.join(tmp_path, f'{name}.npy'), feature)
+    try:
+        os.rename(tmp_path, cache_path)
+    except OSError:
+        # another process has already saved the same features
+        shutil.rmtree(tmp_path, ignore_errors=True)
 
 
 class BertJointIntentSlotDataset(Dataset):
@@ -159,6 +424,14 @@ class BertJointIntentSlotDataset(Dataset):
         shuffle: whether to shuffle
         pad_label: pad value use for slot labels.
                    by default, it's the neural label.
+        tokenize_workers: number of processes used to tokenize the queries.
+        cache_dir: if set, the features are saved under this directory
+                   (e.g. ~/.cache/nemo_nlp) and memory-mapped from there,
+                   also by later runs on the same files, tokenizer and
+                   settings. Not used when num_samples is positive.
+        bucket: if True, samples are returned without padding and must be
+                batched with collate_fn, ideally in the order given by
+                LengthBucketSampler.
 
     """
 
@@ -169,61 +442,173 @@ class BertJointIntentSlotDataset(Dataset):
                  tokenizer,
                  num_samples=-1,
                  shuffle=True,
-                 pad_label=128):
+                 pad_label=128,
+                 tokenize_workers=1,
+                 cache_dir=None,
+                 bucket=False):
         if num_samples == 0:
             raise ValueError("num_samples has to be positive", num_samples)
 
-        with open(slot_file, 'r') as f:
-            slot_lines = f.readlines()
-
-        with open(input_file, 'r') as f:
-            input_lines = f.readlines()[1:]
-
-        assert len(slot_lines) == len(input_lines)
-
-        dataset = list(zip(slot_lines, input_lines))
-
-        if shuffle or num_samples > 0:
-            random.shuffle(dataset)
-        if num_samples > 0:
-            dataset = dataset[:num_samples]
-
-        raw_slots, queries, raw_intents = [], [], []
-        for slot_line, input_line in dataset:
-            raw_slots.append([int(slot) for slot in slot_line.strip().split()])
-            parts = input_line.strip().split()
-            raw_intents.append(int(parts[-1]))
-            queries.append(' '.join(parts[:-1]))
-
-        features = get_features(queries,
-                                max_seq_length,
-                                tokenizer,
-                                pad_label=pad_label,
-                                raw_slots=raw_slots)
-        self.all_input_ids = features[0]
-        self.all_segment_ids = features[1]
-        self.all_input_masks = features[2]
-        self.all_slot_masks = features[3]
-        self.all_slots = features[4]
-        self.all_intents = raw_intents
+        cache_path = None
+        if cache_dir is not None and num_samples < 0:
+            cache_path = os.path.join(
+                os.path.expanduser(cache_dir), _features_cache_key(
+                input_file, slot_file, tokenizer,
+                max_seq_length, pad_label, shuffle))
+
+        if cache_path is not None and os.path.isdir(cache_path):
+            logger.info(f'Loading cached features from {cache_path}')
+            features = _load_cached_features(cache_path)
+        else:
+            input_lines = _iter_lines(input_file)
+            next(input_lines, None)  # skip the header
+            dataset = _zip_lines(_iter_lines(slot_file), input_lines)
+
+            if num_samples > 0:
+                dataset = _reservoir_sample(dataset, num_samples)
+                random.shuffle(dataset)
+            elif shuffle:
+                dataset = list(dataset)
+                dataset = map(dataset.__getitem__,
+                              np.random.permutation(len(dataset)))
+
+            raw_slots, queries, raw_intents = [], [], []
+            for slot_line, input_line in dataset:
+                raw_slots.append(_parse_slots(slot_line))
+                parts = input_line.strip().split()
+                raw_intents.append(int(parts[-1]))
+                queries.append(' '.join(parts[:-1]))
+
+            features = get_features(queries,
+                                    max_seq_length,
+                                    tokenizer,
+                                    pad_label=pad_label,
+                                    raw_slots=raw_slots,
+                                    num_workers=tokenize_workers)
+            features += (np.asarray(raw_intents, dtype=np.int64),)
+            if cache_path is not None:
+                _save_cached_features(cache_path, features)
+                logger.info(f'Saved features to {cache_path}')
+                features = _load_cached_features(cache_path)
+
+        self._cache_path = cache_path
+        self._shared_features = None
+        for name, feature in zip(_CACHED_FEATURES, features):
+            setattr(self, f'all_{name}', feature)
+
+        self.sent_lengths = np.count_nonzero(self.all_input_masks, axis=1)
+        self.pad_label = pad_label
+        self.bucket = bucket
 
         infold = input_file[:input_file.rfind('/')]
         logger.info('Three most popular intents')
         get_label_stats(self.all_intents, infold + '/intent_stats.tsv')
-        merged_slots = itertools.chain.from_iterable(self.all_slots)
         logger.info('Three most popular slots')
-        get_label_stats(merged_slots, infold + '/slot_stats.tsv')
+        get_label_stats(self.all_slots.ravel(), infold + '/slot_stats.tsv')
+
+    def _share_memory(self):
+        # DataLoader workers get the dataset pickled when they are spawned,
+        # which would copy the arrays into each of them. Tensors in shared
+        # memory are pickled as handles to the same pages instead.
+        # Forked workers already share the arrays copy-on-write and never
+        # pickle the dataset, so this only runs from __getstate__.
+        self._shared_features = {}
+        for name in _CACHED_FEATURES:
+            tensor = torch.from_numpy(getattr(self, f'all_{name}'))
+            self._shared_features[name] = tensor.share_memory_()
+            setattr(self, f'all_{name}', tensor.numpy())
+
+    def __getstate__(self):
+        if self._cache_path is None and self._shared_features is None:
+            self._share_memory()
+        state = self.__dict__.copy()
+        for name in _CACHED_FEATURES:
+            del state[f'all_{name}']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._cache_path is not None:
+            # memory-mapped cache files are shared through the page cache
+            features = _load_cached_features(self._cache_path)
+        else:
+            features = [self._shared_features[name].numpy()
+                        for name in _CACHED_FEATURES]
+        for name, feature in zip(_CACHED_FEATURES, features):
+            setattr(self, f'all_{name}', feature)
 
     def __len__(self):
         return len(self.all_input_ids)
 
     def __getitem__(self, idx):
-        return (np.array(self.all_input_ids[idx]),
-                np.array(self.all_segment_ids[idx]),
-                np.array(self.all_input_masks[idx], dtype=np.float32),
-                np.array(self.all_slot_masks[idx]),
+        length = self.sent_lengths[idx] if self.bucket else None
+        return (self.all_input_ids[idx, :length],
+                self.all_segment_ids[idx, :length],
+                self.all_input_masks[idx, :length],
+                self.all_slot_masks[idx, :length],
                 self.all_intents[idx],
-                np.array(self.all_slots[idx]))
+                self.all_slots[idx, :length])
+
+    def get_lengths(self):
+        return self.sent_lengths
+
+    def collate_fn(self, batch):
+        """Pads a batch of unpadded samples to its longest sample."""
+        max_length = max(len(sample[0]) for sample in batch)
+        pad_values = (0, 0, 0, False, None, self.pad_label)
+        collated = []
+        for field, pad_value in zip(zip(*batch), pad_values):
+            if pad_value is None:
+                collated.append(torch.as_tensor(np.asarray(field)))
+                continue
+            padded = np.full((len(batch), max_length), pad_value,
+                             dtype=field[0].dtype)
+            for i, row in enumerate(field):
+                padded[i, :len(row)] = row
+            collated.append(torch.from_numpy(padded))
+        return collated
+
+
+class LengthBucketSampler(Sampler):
+    """
+    Orders samples by length, so that every batch_size consecutive indices
+    hold samples of similar length and only need padding up to the longest
+    of them. To be used as the sampler of a DataLoader with the same
+    batch_size, together with BertJointIntentSlotDataset.collate_fn.
+
+    Args:
+        lengths: length of every sample, such as returned by
+                 BertJointIntentSlotDataset.get_lengths()
+        batch_size: batch size of the DataLoader
+        shuffle: whether to shuffle samples of the same length and
+                 the order of the batches
+    """
+
+    def __init__(self, lengths, batch_size, shuffle=True):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+
+    def __iter__(self):
+        if self.shuffle:
+            perm = np.random.permutation(len(self.lengths))
+            order = perm[np.argsort(self.lengths[perm], kind='stable')]
+        else:
+            order = np.argsort(self.lengths, kind='stable')
+
+        batches = [order[i:i + self.batch_size]
+                   for i in range(0, len(order), self.batch_size)]
+        if self.shuffle and batches:
+            # the last batch may be incomplete and has to stay last for
+            # the DataLoader to split the indices into the same batches
+            last = batches.pop()
+            batches = [batches[k] for k in np.random.permutation(len(batches))]
+            batches.append(last)
+        for batch in batches:
+            yield from batch.tolist()
+
+    def __len__(self):
+        return len(self.lengths)
 
 
 class BertJointIntentSlotInferDataset(Dataset):
@@ -259,7 +644,7 @@ class BertJointIntentSlotInferDataset(Dataset):
         return len(self.all_input_ids)
 
     def __getitem__(self, idx):
-        return (np.array(self.all_input_ids[idx]),
-                np.array(self.all_segment_ids[idx]),
-                np.array(self.all_input_masks[idx], dtype=np.float32),
-                np.array(self.all_slot_masks[idx]))
+        return (self.all_input_ids[idx],
+                self.all_segment_ids[idx],
+                self.all_input_masks[idx],
+                self.all_slot_masks[idx])
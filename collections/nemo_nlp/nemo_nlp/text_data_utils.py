@@ -432,7 +432,7 @@ def process_snips(data_dir, uncased, modes=['train', 'test'], dev_split=0.1):
 
 
 def list2str(nums):
-    return ' '.join([str(num) for num in nums])
+    return ' '.join(map(str, nums))
 
 
 def merge(data_dir, subdirs, dataset_name, modes=['train', 'test']):
@@ -0,0 +1,240 @@
+# Copyright (c) 2019 NVIDIA Corporation
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+from .context import nemo, nemo_nlp
+from .common_setup import NeMoUnitTest
+
+from nemo_nlp.data.datasets import BertJointIntentSlotDataset, \
+    LengthBucketSampler
+from nemo_nlp.data.datasets.joint_intent_slot import _fill_rows, \
+    _fill_rows_numba, _fill_rows_numpy
+
+
+FORK_AFTER_FEATURES = """
+import multiprocessing
+
+import numpy as np
+
+from nemo_nlp.data.datasets.joint_intent_slot import get_features
+
+
+class Tokenizer(object):
+    def tokenize(self, word):
+        return list(word)
+
+    def convert_tokens_to_ids(self, tokens):
+        return [len(token) for token in tokens]
+
+
+get_features(['a bc', 'abc de f'], 4, Tokenizer(),
+             raw_slots=[np.array([0, 1]), np.array([2, 3, 4])])
+process = multiprocessing.get_context('fork').Process(target=print)
+process.start()
+process.join()
+"""
+
+
+class CharTokenizer(object):
+    """Splits every word into characters, the first one with a '##'."""
+
+    def __init__(self):
+        self.vocab = {'[CLS]': 1, '[SEP]': 2}
+        self.num_calls = 0
+
+    def tokenize(self, word):
+        self.num_calls += 1
+        return [word[0]] + ['##' + c for c in word[1:]]
+
+    def convert_tokens_to_ids(self, tokens):
+        return [self.vocab.setdefault(t, len(self.vocab) + 1)
+                for t in tokens]
+
+
+class TestJointIntentSlot(NeMoUnitTest):
+
+    def setUp(self):
+        super().setUp()
+        self.data_dir = tempfile.mkdtemp()
+        queries = ['a bc', 'abc de f', 'g', 'hi jk']
+        slots = ['0 1', '2 3 4', '5', '6 7']
+        with open(os.path.join(self.data_dir, 'train.tsv'), 'w') as f:
+            f.write('sentence\tlabel\n')
+            for i, query in enumerate(queries):
+                f.write(f'{query}\t{i}\n')
+        with open(os.path.join(self.data_dir, 'train_slots.tsv'), 'w') as f:
+            f.write('\n'.join(slots) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def make_dataset(self, tokenizer, **kwargs):
+        return BertJointIntentSlotDataset(
+            input_file=os.path.join(self.data_dir, 'train.tsv'),
+            slot_file=os.path.join(self.data_dir, 'train_slots.tsv'),
+            tokenizer=tokenizer,
+            shuffle=False,
+            **kwargs)
+
+    def assertFeaturesEqual(self, dataset, other):
+        for name in ('input_ids', 'segment_ids', 'input_masks',
+                     'slot_masks', 'slots', 'intents'):
+            self.assertTrue(np.array_equal(getattr(dataset, f'all_{name}'),
+                                           getattr(other, f'all_{name}')))
+
+    def test_length_bucket_sampler(self):
+        lengths = [5, 1, 3, 3, 2, 8, 7, 4, 6, 2]
+        batch_size = 3
+        indices = list(LengthBucketSampler(lengths, batch_size))
+
+        self.assertEqual(sorted(indices), list(range(len(lengths))))
+        batches = [indices[i:i + batch_size]
+                   for i in range(0, len(indices), batch_size)]
+        # only the last batch is incomplete
+        self.assertEqual(len(batches[-1]), len(lengths) % batch_size)
+        self.assertTrue(all(len(b) == batch_size for b in batches[:-1]))
+        # batches hold consecutive lengths, so their ranges never overlap
+        ranges = sorted((min(lengths[i] for i in batch),
+                         max(lengths[i] for i in batch))
+                        for batch in batches)
+        for (_, prev_max), (next_min, _) in zip(ranges, ranges[1:]):
+            self.assertLessEqual(prev_max, next_min)
+
+    def test_collate_fn(self):
+        pad_label = 9
+        dataset = BertJointIntentSlotDataset(
+            input_file=os.path.join(self.data_dir, 'train.tsv'),
+            slot_file=os.path.join(self.data_dir, 'train_slots.tsv'),
+            max_seq_length=16,
+            tokenizer=CharTokenizer(),
+            shuffle=False,
+            pad_label=pad_label,
+            bucket=True)
+        lengths = dataset.get_lengths()
+        self.assertEqual(lengths.tolist(), [5, 8, 3, 6])
+
+        samples = [dataset[0], dataset[2]]
+        self.assertEqual([len(sample[0]) for sample in samples], [5, 3])
+        ids, segment_ids, input_mask, slot_mask, intents, slots = \
+            dataset.collate_fn(samples)
+
+        self.assertEqual(tuple(ids.shape), (2, 5))
+        self.assertEqual(ids[1, 3:].tolist(), [0, 0])
+        self.assertEqual(segment_ids[1, 3:].tolist(), [0, 0])
+        self.assertEqual(input_mask.tolist(), [[1] * 5, [1] * 3 + [0] * 2])
+        self.assertEqual(slot_mask.tolist(),
+                         [[True, True, True, False, True],
+                          [True, True, True, False, False]])
+        self.assertEqual(intents.tolist(), [0, 2])
+        self.assertEqual(slots.tolist(),
+                         [[pad_label, 0, 1, 1, pad_label],
+                          [pad_label, 5, pad_label, pad_label, pad_label]])
+
+    def test_fill_rows(self):
+        max_seq_length = 4
+        pad_label = 9
+        # truncated, exact-length and short rows
+        rows = [[1, 11, 12, 13, 14, 15, 2], [1, 21, 22, 2], [1, 2]]
+        row_slots = [[pad_label, 3, 3, 4, 5, 5, pad_label],
+                     [pad_label, 6, 7, pad_label],
+                     [pad_label, pad_label]]
+        row_slot_masks = [[True, True, False, True, True, False, True],
+                          [True, True, True, True],
+                          [True, True]]
+        offsets = np.cumsum([0] + [len(row) for row in rows])
+        flat_ids = np.concatenate(rows).astype(np.int64)
+        flat_slot_masks = np.concatenate(row_slot_masks).astype(np.bool_)
+        flat_slots = np.concatenate(row_slots).astype(np.int64)
+
+        fill_fns = [_fill_rows, _fill_rows_numpy]
+        if _fill_rows_numba is not None:
+            fill_fns.append(_fill_rows_numba)
+        results = []
+        for fill_rows in fill_fns:
+            shape = (len(rows), max_seq_length)
+            outputs = (np.zeros(shape, dtype=np.int64),
+                       np.zeros(shape, dtype=np.uint8),
+                       np.zeros(shape, dtype=np.bool_),
+                       np.full(shape, pad_label, dtype=np.int64))
+            fill_rows(offsets, flat_ids, flat_slot_masks, flat_slots,
+                      *outputs, True)
+            results.append(outputs)
+
+        input_ids, input_masks, slot_masks, slots = results[0]
+        self.assertEqual(input_ids.tolist(),
+                         [[1, 14, 15, 2], [1, 21, 22, 2], [1, 2, 0, 0]])
+        self.assertEqual(input_masks.tolist(),
+                         [[1, 1, 1, 1], [1, 1, 1, 1], [1, 1, 0, 0]])
+        self.assertEqual(slot_masks.tolist(),
+                         [[True, True, False, True],
+                          [True, True, True, True],
+                          [True, True, False, False]])
+        self.assertEqual(slots.tolist(),
+                         [[pad_label, 5, 5, pad_label],
+                          [pad_label, 6, 7, pad_label],
+                          [pad_label] * 4])
+        for outputs in results[1:]:
+            for expected, actual in zip(results[0], outputs):
+                self.assertTrue(np.array_equal(expected, actual))
+
+    def test_features_cache(self):
+        cache_dir = os.path.join(self.data_dir, 'cache')
+        tokenizer = CharTokenizer()
+        dataset = self.make_dataset(tokenizer, max_seq_length=16,
+                                    cache_dir=cache_dir)
+        self.assertGreater(tokenizer.num_calls, 0)
+        # the temporary directory was renamed into the cache entry
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+        tokenizer = CharTokenizer()
+        cached = self.make_dataset(tokenizer, max_seq_length=16,
+                                   cache_dir=cache_dir)
+        self.assertEqual(tokenizer.num_calls, 0)
+        self.assertFeaturesEqual(cached, dataset)
+        self.assertIs(type(cached.all_input_ids), np.ndarray)
+
+        uncached = self.make_dataset(CharTokenizer(), max_seq_length=16)
+        self.assertFeaturesEqual(cached, uncached)
+
+        tokenizer = CharTokenizer()
+        self.make_dataset(tokenizer, max_seq_length=4, cache_dir=cache_dir)
+        self.assertGreater(tokenizer.num_calls, 0)
+
+        input_file = os.path.join(self.data_dir, 'train.tsv')
+        mtime = os.stat(input_file).st_mtime + 10
+        os.utime(input_file, (mtime, mtime))
+        tokenizer = CharTokenizer()
+        self.make_dataset(tokenizer, max_seq_length=16, cache_dir=cache_dir)
+        self.assertGreater(tokenizer.num_calls, 0)
+        self.assertEqual(len(os.listdir(cache_dir)), 3)
+
+        unpickled = pickle.loads(pickle.dumps(cached))
+        self.assertFeaturesEqual(unpickled, cached)
+
+    def test_pickle(self):
+        dataset = self.make_dataset(CharTokenizer(), max_seq_length=16)
+        unpickled = pickle.loads(pickle.dumps(dataset))
+        self.assertFeaturesEqual(unpickled, dataset)
+        # pickling moves the arrays into shared memory, they must still
+        # be arrays on the original dataset
+        for name in ('input_ids', 'segment_ids', 'input_masks',
+                     'slot_masks', 'slots', 'intents'):
+            self.assertIs(type(getattr(dataset, f'all_{name}')), np.ndarray)
+            self.assertIs(type(getattr(unpickled, f'all_{name}')),
+                          np.ndarray)
+
+    @unittest.skipIf(sys.platform == 'win32', 'fork is not available')
+    def test_fork_after_get_features(self):
+        # a fork after the padding kernel ran must not hang the parent
+        # at exit, as DataLoader workers are forked after featurization
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        result = subprocess.run([sys.executable, '-c', FORK_AFTER_FEATURES],
+                                env=env, timeout=120)
+        self.assertEqual(result.returncode, 0)